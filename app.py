@@ -1,21 +1,84 @@
+# Patch sockets before anything else is imported so PyMongo and Azure I/O yield to other requests
+from gevent import monkey
+monkey.patch_all()
+
 from flask import Flask, jsonify, request, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
-from pymongo import MongoClient
+import gzip
+import orjson
+import time
+from functools import lru_cache
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from bson.codec_options import CodecOptions
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
 from azure.storage.blob import BlobServiceClient
 
 load_dotenv()
 
+# Serializes JSON with orjson, which encodes straight to bytes in native code
+# Types orjson cannot encode (e.g. Decimal) fall back to Flask's default encoder
+def to_json(obj):
+    return orjson.dumps(obj, default=DefaultJSONProvider.default)
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return to_json(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(to_json(obj), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 CORS(app)
 
 # MongoDB connection 
 mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
-client = MongoClient(mongo_uri)
+# Pool sized for concurrent workers; minPoolSize pre-opens sockets so early requests skip the handshake
+client = MongoClient(
+    mongo_uri,
+    maxPoolSize=200,
+    minPoolSize=10,
+    maxIdleTimeMS=300_000,
+    serverSelectionTimeoutMS=2000,
+    retryWrites=True
+)
 db = client.productdb
-collection = db.products
+# Codec options are pinned explicitly so every read decodes to plain dicts without tz handling
+collection = db.get_collection('products', codec_options=CodecOptions(document_class=dict, tz_aware=False))
+counters = db.counters
+
+# Shared projection that hides MongoDB's internal _id from API responses
+PROJ_NO_ID = {'_id': 0}
+
+# Bound once so the read routes skip the attribute lookup on every request
+find_products = collection.find
+find_product = collection.find_one
+
+# Azure Blob Storage connection
+# A single client is reused so the HTTP connection pool is shared across requests
+# It is created on first use so a missing or bad BLOB_CONN_STR only makes image requests 404
+# The first GET covers any image small enough to cache, so typical product images take a single request
+# Larger images are downloaded lazily in 16 MiB chunks, which bounds memory per streamed image
+IMAGE_CACHE_MAX_BYTES = 1024 * 1024
+
+@lru_cache(maxsize=None)
+def get_container_client():
+    blob_service = BlobServiceClient.from_connection_string(
+        os.getenv("BLOB_CONN_STR"),
+        max_single_get_size=IMAGE_CACHE_MAX_BYTES,
+        max_chunk_get_size=16 * 1024 * 1024
+    )
+    return blob_service.get_container_client("product-images")
 
 # Seed initial data if collection is empty
 def seed_data():
@@ -105,11 +168,94 @@ def seed_data():
                 "category": "Computer Accessories"
             }
         ]
-        collection.insert_many(initial_products)
-        print("Database seeded successfully.")
+        try:
+            collection.insert_many(initial_products)
+            print("Database seeded successfully.")
+        except BulkWriteError:
+            # Another worker seeded the collection first
+            pass
+
+# Make sure the id counter starts after the highest existing id
+def init_product_ids():
+    last_product = collection.find_one(sort=[("id", -1)])
+    if last_product:
+        counters.update_one({"_id": "product_id"}, {"$max": {"seq": last_product['id']}}, upsert=True)
+
+# Allocates the next product ID atomically so concurrent POSTs never share an ID
+def next_product_id():
+    counter = counters.find_one_and_update(
+        {"_id": "product_id"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
+# Prepares the database, retrying while MongoDB is still starting (e.g. in compose or k8s)
+# Requests keep the short serverSelectionTimeoutMS; only startup waits up to MONGO_STARTUP_TIMEOUT seconds
+def init_database():
+    deadline = time.monotonic() + int(os.getenv('MONGO_STARTUP_TIMEOUT', 60))
+    while True:
+        try:
+            # The unique index is created first so workers seeding concurrently cannot insert duplicates
+            collection.create_index([("id", 1)], unique=True)
+            seed_data()
+            init_product_ids()
+            return
+        except ConnectionFailure:
+            if time.monotonic() >= deadline:
+                raise
+            print("Waiting for MongoDB...")
+            time.sleep(2)
 
 # Run seeding immediately on startup
-seed_data()
+init_database()
+
+# Catalog cache: serialized product responses keyed by catalog version
+# The version lives in the counters collection so a write in any worker invalidates every worker's cache
+# Each worker re-reads it at most every CATALOG_VERSION_INTERVAL seconds, so cache hits skip MongoDB entirely
+# and a write made by another worker is visible within that interval
+# The TTL only bounds staleness from changes made to the database outside this service
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+CACHE_MAXSIZE = 1024
+CATALOG_VERSION_INTERVAL = 1
+catalog_cache = {}
+catalog_version = 0
+catalog_version_checked = float('-inf')
+
+def current_catalog_version():
+    global catalog_version, catalog_version_checked
+    now = time.monotonic()
+    if now - catalog_version_checked >= CATALOG_VERSION_INTERVAL:
+        counter = counters.find_one({"_id": "catalog_version"})
+        catalog_version = counter['seq'] if counter else 0
+        catalog_version_checked = now
+    return catalog_version
+
+def cache_get(key, version):
+    entry = catalog_cache.get((key, version))
+    if entry and time.monotonic() - entry[0] < CACHE_TTL:
+        return entry[1]
+    return None
+
+# The version is read before the DB read so a result fetched during a write is never stored as current
+def cache_set(key, version, value):
+    if len(catalog_cache) >= CACHE_MAXSIZE:
+        catalog_cache.clear()
+    catalog_cache[(key, version)] = (time.monotonic(), value)
+
+# The writing worker adopts the new version immediately, so its own reads never see stale data
+def invalidate_catalog():
+    global catalog_version, catalog_version_checked
+    counter = counters.find_one_and_update(
+        {"_id": "catalog_version"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    catalog_version = counter['seq']
+    catalog_version_checked = time.monotonic()
+    catalog_cache.clear()
 
 # Flask routes
 # Health check endpoint
@@ -121,32 +267,50 @@ def health():
 # store-front: gets all products
 @app.route('/', methods=['GET'])
 def get_products():
-    products = list(collection.find({}, {'_id': 0}))
-    return jsonify(products)
+    version = current_catalog_version()
+    cached = cache_get('all', version)
+    if cached is None:
+        cursor = find_products({}, PROJ_NO_ID).batch_size(200)
+        payload = to_json(list(cursor))
+        # Compressed once per catalog version rather than on every request
+        cached = (payload, gzip.compress(payload, compresslevel=6))
+        cache_set('all', version, cached)
+    payload, compressed = cached
+
+    # Check the quality value: "gzip;q=0" means the client refuses gzip
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(compressed, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(payload, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return response
 
 # store-front: gets a single product by ID
 # Note: add the call later to query MongoDB for past orders for the recommendations feature
 @app.route('/<int:product_id>', methods=['GET'])
 def get_product(product_id):
-    product = collection.find_one({"id": product_id}, {'_id': 0})
-    if product:
-        return jsonify(product)
-    else:
-        return "Product not found", 404
+    version = current_catalog_version()
+    payload = cache_get(product_id, version)
+    if payload is None:
+        product = find_product({"id": product_id}, PROJ_NO_ID)
+        if not product:
+            return "Product not found", 404
+        payload = to_json(product)
+        cache_set(product_id, version, payload)
+    return Response(payload, mimetype='application/json')
 
 # store-admin: adds a new product
 @app.route('/', methods=['POST'])
 def add_product():
-    if not request.json:
+    # Only a JSON object can become a product; reject anything else before an ID is allocated
+    if not request.json or not isinstance(request.json, dict):
         return "Invalid input", 400
-    # We query the DB for the highest ID to ensure safety
-    last_product = collection.find_one(sort=[("id", -1)])
-    new_id = (last_product['id'] + 1) if last_product else 1
-
     new_product = request.json
-    new_product['id'] = new_id
+    new_product['id'] = next_product_id()
     
     collection.insert_one(new_product)
+    invalidate_catalog()
     
     # Return created object (without _id)
     del new_product['_id']
@@ -161,13 +325,19 @@ def update_product():
     update_data = request.json
     target_id = update_data['id']
     
-    result = collection.update_one({"id": target_id}, {"$set": update_data})
+    # Update and fetch the updated product in a single round trip
+    updated_product = collection.find_one_and_update(
+        {"id": target_id},
+        {"$set": update_data},
+        projection=PROJ_NO_ID,
+        return_document=ReturnDocument.AFTER
+    )
     
-    if result.matched_count == 0:
+    if updated_product is None:
         return "Product not found", 404
+    invalidate_catalog()
 
     # Return the updated product
-    updated_product = collection.find_one({"id": target_id}, {'_id': 0})
     return jsonify(updated_product)
 
 # store-admin deletes a product by ID
@@ -179,23 +349,75 @@ def delete_product(product_id):
     # If no product was deleted, it means it wasn't found
     if result.deleted_count == 0:
         return "Product not found", 404
+    invalidate_catalog()
 
     return "", 200
 
+# Image cache: small, hot images are kept in memory and refreshed after IMAGE_CACHE_TTL seconds
+# Larger images are streamed from Blob Storage instead of being cached
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', 300))
+IMAGE_CACHE_MAXSIZE = 256
+image_cache = {}
+
+# Returns (body, mimetype, etag); failed downloads raise and are therefore never cached
+# On a cache miss the client's ETag is sent to Blob Storage, which raises a 304 error instead of sending an unchanged body
+def load_image(filename, client_etag=None):
+    entry = image_cache.get(filename)
+    if entry and time.monotonic() - entry[0] < IMAGE_CACHE_TTL:
+        return entry[1]
+
+    blob_client = get_container_client().get_blob_client(filename)
+    if client_etag:
+        stream = blob_client.download_blob(etag=f'"{client_etag}"', match_condition=MatchConditions.IfModified)
+    else:
+        stream = blob_client.download_blob()
+    content_type = stream.properties.content_settings.content_type
+    mimetype = content_type if content_type and content_type.startswith("image/") else "image/jpeg"
+    etag = stream.properties.etag.strip('"')
+
+    if stream.properties.size > IMAGE_CACHE_MAX_BYTES:
+        # Only the first GET is buffered; the remaining chunks are fetched as the client reads them
+        return stream.chunks(), mimetype, etag
+
+    image = (stream.readall(), mimetype, etag)
+    image_cache.pop(filename, None)
+    if len(image_cache) >= IMAGE_CACHE_MAXSIZE:
+        # Evict the oldest entry
+        image_cache.pop(next(iter(image_cache)))
+    image_cache[filename] = (time.monotonic(), image)
+    return image
+
 # store-front & store-admin: serves product images from Azure Blob Storage to store-front
 @app.route('/images/<filename>')
 def get_image(filename):
+    # Blob Storage accepts a single ETag, so only forward If-None-Match when it names exactly one
+    client_etags = request.if_none_match.as_set()
+    client_etag = next(iter(client_etags)) if len(client_etags) == 1 else None
+
     try:
-        blob_service = BlobServiceClient.from_connection_string(os.getenv("BLOB_CONN_STR"))
-        blob_client = blob_service.get_blob_client(container="product-images", blob=filename)
-        image_data = blob_client.download_blob().readall()
+        image_data, mimetype, etag = load_image(filename, client_etag)
 
-        # Return the data
-        return Response(image_data, mimetype="image/jpeg")
+        # Return the data, or 304 Not Modified if the browser already has this version
+        response = Response(image_data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.cache_control.max_age = 86400
+        return response.make_conditional(request)
+
+    except HttpResponseError as e:
+        # The blob still matches the browser's copy, so nothing was downloaded
+        if e.status_code == 304:
+            response = Response(status=304)
+            response.set_etag(client_etag)
+            response.cache_control.max_age = 86400
+            return response
+        return "Image not found", 404
 
     except Exception as e:
         return "Image not found", 404
 
+# Production is served by gunicorn with gevent workers (see Dockerfile):
+#   gunicorn -k gevent -w 4 --worker-connections 1000 --timeout 90 -b 0.0.0.0:$PORT app:app
+# Local development can still use the Flask dev server
 if __name__ == '__main__':
     # Maps to: settings.port: 3002
     port = int(os.getenv('PORT', 3002))